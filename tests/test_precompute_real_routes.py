@@ -0,0 +1,94 @@
+"""Tests for tools/precompute_real_routes.py.
+
+Run from the repo root:
+  py -m unittest discover tests
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "tools"))
+
+import precompute_real_routes as prr  # noqa: E402
+
+HUBS = [
+    {"id": "HUB_A", "name": "Hub A", "lng": -1.93, "lat": 52.47},
+    {"id": "HUB_B", "name": "Hub B", "lng": -1.92, "lat": 52.48},
+    {"id": "HUB_C", "name": "Hub C", "lng": -1.91, "lat": 52.49},
+    {"id": "HUB_D", "name": "Hub D", "lng": -1.90, "lat": 52.50},
+]
+EDGES = [
+    {"from": "HUB_A", "to": "HUB_B", "distance_m": 1, "duration_s": 1, "polyline": [[0, 0], [1, 1]]},
+    {"from": "HUB_B", "to": "HUB_C", "distance_m": 1, "duration_s": 1, "polyline": [[0, 0], [1, 1]]},
+    {"from": "HUB_C", "to": "HUB_D", "distance_m": 1, "duration_s": 1, "polyline": [[0, 0], [1, 1]]},
+]
+UNROUTABLE = ((-1.91, 52.49), (-1.90, 52.50))  # HUB_C -> HUB_D
+
+
+def fake_route_osrm(points):
+    """Stands in for OSRM: like the real router, one bad leg fails the request."""
+    legs = []
+    for a, b in zip(points, points[1:]):
+        if (a, b) == UNROUTABLE:
+            raise OSError("HTTP 400 from OSRM: NoRoute")
+        legs.append({"coords": [list(a), list(b)], "distance_m": 100, "duration_s": 10})
+    return legs
+
+
+class ChainFailureTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data = Path(tmp.name)
+        (self.data / "hubs.json").write_text(json.dumps({"hubs": HUBS}))
+        (self.data / "edges.json").write_text(json.dumps({"edges": EDGES}))
+        (self.data / "locations.json").write_text(json.dumps({"locations": []}))
+
+        self.route = mock.Mock(side_effect=fake_route_osrm)
+        for name, value in [
+            ("DATA", self.data),
+            ("CACHE_PATH", self.data / ".osrm_cache"),
+            ("route_osrm", self.route),
+            # main() rebinds these; patch them so the originals come back.
+            ("OSRM_BASE", prr.OSRM_BASE),
+            ("WORKERS", prr.WORKERS),
+            ("LIMITER", prr.LIMITER),
+        ]:
+            patcher = mock.patch.object(prr, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_main(self):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            prr.main(["--osrm-base", "http://localhost:5000", "--delay", "0"])
+        return json.loads((self.data / "edges.real.json").read_text())["edges"]
+
+    def test_one_unroutable_leg_only_loses_that_edge(self):
+        out = self.run_main()
+
+        self.assertEqual(
+            [(e["from"], e["to"]) for e in out],
+            [(e["from"], e["to"]) for e in EDGES],
+        )
+        # The routable edges keep real geometry (and a key for reuse).
+        for e in out[:2]:
+            self.assertIn("key", e)
+            self.assertEqual(e["distance_m"], 100)
+        # Only the unroutable one falls back to its edges.json geometry.
+        self.assertEqual(out[2], EDGES[2])
+
+        # One chain request, then each edge on its own.
+        sizes = [len(c.args[0]) for c in self.route.call_args_list]
+        self.assertEqual(sizes[0], 4)
+        self.assertEqual(sorted(sizes[1:]), [2, 2, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,106 +16,669 @@ Why:
 
 Note:
 - This script uses the public OSRM demo router by default (good for prototypes).
-- For scaling, swap OSRM_BASE to your own OSRM instance built from your .osm.pbf.
+- For scaling, point --osrm-base at your own OSRM instance built from your
+  .osm.pbf, e.g. (after osrm-extract / osrm-partition / osrm-customize):
+
+    docker run -p 5000:5000 -v "$PWD:/data" osrm/osrm-backend \
+        osrm-routed --algorithm mld --mmap /data/region.osrm
+    py tools/precompute_real_routes.py --osrm-base http://localhost:5000
+
+  A local router answers in about a millisecond and has no rate limit, so
+  the request delay drops to 0 and more requests run in parallel.
 """
 
+import argparse
+import hashlib
+import http.client
 import json
+import os
+import queue
+import random
+import shelve
+import sys
+import threading
 import time
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.parse import urlsplit
 
 ROOT = Path(__file__).resolve().parents[1]
 DATA = ROOT / "docs" / "data"
+CACHE_PATH = DATA / ".osrm_cache"  # shelve db of routed legs, reused across runs
+
+OSRM_BASE = "https://router.project-osrm.org"  # override with --osrm-base
+# Minimum seconds between request starts, across all workers. The public
+# OSRM demo's usage policy allows at most 1 request per second.
+DELAY = 1.0
+WORKERS = 16  # requests in flight at once
+LOCAL_WORKERS = 64  # requests in flight against a router on this machine
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+TIMEOUT = 10  # socket timeout per request, seconds
+# The public OSRM demo's usage policy asks clients to identify themselves.
+USER_AGENT = "go-dot-delivery precompute_real_routes"
+RETRIES = 5  # extra attempts per request before falling back
+BACKOFF = 0.5  # seconds; retry n waits up to BACKOFF * 2**n (jittered)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_LEGS = 24  # hub edges routed per multi-waypoint request
+MAX_TABLE = 99  # locations per /table request (plus their hub)
+PROGRESS_INTERVAL = 0.1  # min seconds between progress line redraws
+
+
+# Set when run_tasks is abandoned (Ctrl+C, or an error in the caller), so
+# workers still waiting on a token or a retry give up instead of sending.
+CANCEL = threading.Event()
+
+
+class Cancelled(Exception):
+    """Raised in a worker once CANCEL is set."""
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads.
+
+    Each acquire() takes a token which a timer hands back `interval` seconds
+    later, so no more than `burst` requests start in any `interval` window.
+    Threads only wait for a token, never for each other's responses.
+    """
+
+    def __init__(self, interval, burst=1):
+        self.interval = interval
+        self._tokens = threading.Semaphore(burst)
+
+    def acquire(self):
+        while not self._tokens.acquire(timeout=0.1):
+            if CANCEL.is_set():
+                raise Cancelled()
+        if self.interval <= 0:
+            self._tokens.release()
+            return
+        t = threading.Timer(self.interval, self._tokens.release)
+        t.daemon = True
+        t.start()
 
-OSRM_BASE = "https://router.project-osrm.org"  # swap to your own router later
-DELAY = 0.15  # seconds between requests
+
+LIMITER = RateLimiter(DELAY)
+
+# One keep-alive connection per worker thread, so the TCP/TLS handshake is
+# paid once per worker instead of once per request.
+_local = threading.local()
 
 
 def load_json(p: Path):
-    with p.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return json.loads(p.read_bytes())
 
 
-def save_json(p: Path, obj):
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2)
+class RecordWriter:
+    """Streams {name: [record, ...]} to `p`, in index order, as records arrive.
 
+    add() just queues the record; a background thread serializes and writes
+    it, so JSON encoding and disk I/O overlap the network fetches instead of
+    following them. Records may arrive in any order; each is written as soon
+    as every record before it is in, so only the out-of-order ones stay in
+    memory. Output goes to a temp file that replaces `p` on a clean close,
+    so an interrupted run never leaves the game a truncated file.
 
-def route_osrm(a_lng, a_lat, b_lng, b_lat):
-    url = (
-        f"{OSRM_BASE}/route/v1/driving/"
-        f"{a_lng},{a_lat};{b_lng},{b_lat}"
-        f"?overview=full&geometries=geojson"
-    )
-    with urllib.request.urlopen(url) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
+    Written compact: these files are mostly coordinate arrays, where
+    indent=2 roughly doubles what the game has to download and parse.
+    """
+
+    def __init__(self, p: Path, name):
+        self.path = p
+        self._tmp = p.with_name(p.name + ".tmp")
+        self._f = self._tmp.open("w", encoding="utf-8")
+        self._f.write(f"{{{json.dumps(name)}:[")
+        self._pending = {}
+        self._next = 0
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def add(self, i, record):
+        self._queue.put((i, record))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # keep draining so add() never blocks
+            i, record = item
+            self._pending[i] = record
+            try:
+                while self._next in self._pending:
+                    if self._next:
+                        self._f.write(",")
+                    rec = self._pending.pop(self._next)
+                    self._f.write(json.dumps(rec, separators=(",", ":")))
+                    self._next += 1
+            except Exception as ex:
+                self._error = ex
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queue.put(None)
+        self._thread.join()
+        ok = exc_type is None and self._error is None and not self._pending
+        if ok:
+            self._f.write("]}")
+        self._f.close()
+        if ok:
+            os.replace(self._tmp, self.path)
+        else:
+            self._tmp.unlink()
+        if exc_type is None and self._error is not None:
+            raise self._error
+        if exc_type is None and not ok:
+            raise RuntimeError(f"{self.path.name}: record {self._next} never arrived")
+
+
+_last_progress = 0.0
+_progress_open = False  # progress line drawn without its newline yet
+
+
+def progress(label, done, total):
+    """Redraw the progress line, at most every PROGRESS_INTERVAL seconds.
+
+    The final step is always drawn. Only called from the main thread, which
+    consumes pool results, so no locking is needed.
+    """
+    global _last_progress, _progress_open
+    now = time.monotonic()
+    if done < total and now - _last_progress < PROGRESS_INTERVAL:
+        return
+    _last_progress = now
+    _progress_open = done < total
+    end = "" if _progress_open else "\n"
+    sys.stderr.write(f"\r  {label}: {done}/{total}{end}")
+    sys.stderr.flush()
+
+
+def warn(*args):
+    """Print to stderr on a line of its own, below any open progress line."""
+    global _progress_open
+    if _progress_open:
+        sys.stderr.write("\n")
+        _progress_open = False
+    print(*args, file=sys.stderr, flush=True)
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        u = urlsplit(OSRM_BASE)
+        if u.scheme == "https":
+            conn = http.client.HTTPSConnection(u.netloc, timeout=TIMEOUT)
+        else:
+            conn = http.client.HTTPConnection(u.netloc, timeout=TIMEOUT)
+        _local.conn = conn
+    return conn
+
+
+def osrm_get(path):
+    """GET OSRM_BASE + path on this thread's pooled connection, return JSON.
+
+    Connection errors, timeouts and RETRY_STATUS responses are retried up to
+    RETRIES times, waiting a random 0..BACKOFF * 2**n seconds (or the
+    server's Retry-After) in between. Every attempt waits its turn on
+    LIMITER, so retries never push the overall rate above the cap.
+    """
+    url = urlsplit(OSRM_BASE).path.rstrip("/") + path
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            if CANCEL.wait(wait):
+                raise Cancelled()
+        LIMITER.acquire()
+        conn = _connection()
+        wait = random.uniform(0, BACKOFF * 2**attempt)
+        try:
+            conn.request("GET", url, headers={"User-Agent": USER_AGENT})
+            resp = conn.getresponse()
+            body = resp.read()
+        except (http.client.HTTPException, OSError) as ex:
+            # Dropped keep-alive socket, reset, timeout: start a fresh one.
+            conn.close()
+            _local.conn = None
+            error = ex
+            continue
+        if resp.status == 200:
+            return json.loads(body)
+        error = OSError(f"HTTP {resp.status} from OSRM: {body[:200]!r}")
+        if resp.status not in RETRY_STATUS:
+            raise error
+        retry_after = resp.getheader("Retry-After", "")
+        if retry_after.isdigit():
+            wait = min(int(retry_after), 60)
+    raise OSError(f"gave up after {RETRIES + 1} attempts: {error}") from error
+
+
+def decode_polyline6(s):
+    """Decode an OSRM polyline6 string into [[lng, lat], ...]."""
+    coords = []
+    index = lat = lng = 0
+    while index < len(s):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(s[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append([lng / 1e6, lat / 1e6])
+    return coords
+
+
+def route_osrm(points):
+    """Route through `points` ([(lng, lat), ...]) and return one dict per leg.
+
+    Two points is the plain A->B query. With more, OSRM routes every leg in
+    one request; per-leg polylines are then stitched from the step
+    geometries, and continue_straight=false keeps each leg the same as if
+    it had been routed on its own (no forced through-driving at waypoints).
+    """
+    coords = ";".join(f"{lng},{lat}" for lng, lat in points)
+    if len(points) == 2:
+        query = "overview=full&geometries=polyline6"
+    else:
+        query = "overview=false&steps=true&continue_straight=false&geometries=polyline6"
+    data = osrm_get(f"/route/v1/driving/{coords}?{query}")
     r = data["routes"][0]
+
+    legs = []
+    for leg in r["legs"]:
+        if len(points) == 2:
+            line = decode_polyline6(r["geometry"])  # [[lng,lat],...]
+        else:
+            line = []
+            for step in leg["steps"]:
+                for c in decode_polyline6(step["geometry"]):
+                    if not line or line[-1] != c:
+                        line.append(c)
+        legs.append(
+            {
+                "coords": line,
+                "distance_m": int(round(leg["distance"])),
+                "duration_s": int(round(leg["duration"])),
+            }
+        )
+    return legs
+
+
+def table_osrm(points):
+    """Distance/duration from each of points[1:] to the hub at points[0].
+
+    One /table request covers them all. Returns [(distance_m, duration_s),
+    ...] in points[1:] order, with None where OSRM found no route.
+    """
+    coords = ";".join(f"{lng},{lat}" for lng, lat in points)
+    sources = ";".join(str(n) for n in range(1, len(points)))
+    data = osrm_get(
+        f"/table/v1/driving/{coords}"
+        f"?sources={sources}&destinations=0&annotations=distance,duration"
+    )
+    out = []
+    for dist, dur in zip(data["distances"], data["durations"]):
+        if dist[0] is None or dur[0] is None:
+            out.append(None)
+        else:
+            out.append((int(round(dist[0])), int(round(dur[0]))))
+    return out
+
+
+def osrm_task(fn, task):
+    """Pool-friendly wrapper: (key, points) -> (key, fn(points)).
+
+    On failure the exception is returned in place of the result.
+    """
+    key, points = task
+    try:
+        return key, fn(points)
+    except Exception as ex:
+        return key, ex
+
+
+def run_tasks(label, tasks, fn=None):
+    """Run fn over every task on the thread pool; yields (key, result) as they finish.
+
+    Results come back in completion order, so one slow request never holds
+    up handling (or the progress line) for the ones behind it.
+    """
+    fn = fn or route_osrm
+    CANCEL.clear()
+    finished = False
+    ex = ThreadPoolExecutor(max_workers=WORKERS)
+    try:
+        futures = [ex.submit(osrm_task, fn, t) for t in tasks]
+        for done, fut in enumerate(as_completed(futures), 1):
+            progress(label, done, len(tasks))
+            yield fut.result()
+        finished = True
+    finally:
+        # On Ctrl+C or an error in the caller, drop the queued requests and
+        # stop the waiting ones instead of sending them all just to throw
+        # the results away.
+        if not finished:
+            CANCEL.set()
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def leg_key(a, b):
+    """Cache key for the leg a -> b, and whether the entry is stored as b -> a.
+
+    Endpoints are rounded to 6 dp (OSRM's own precision). The game draws every
+    edge and link in both directions, so A->B and B->A share one entry.
+    Keys include OSRM_BASE so switching routers never serves stale routes.
+    """
+    a = (round(a[0], 6), round(a[1], 6))
+    b = (round(b[0], 6), round(b[1], 6))
+    if b < a:
+        return f"{OSRM_BASE}|{b[0]},{b[1]};{a[0]},{a[1]}", True
+    return f"{OSRM_BASE}|{a[0]},{a[1]};{b[0]},{b[1]}", False
+
+
+def route_key(a, b):
+    """Content hash of a routed record's inputs, stored in the output as "key".
+
+    A record from the previous run is reused as-is when its key still
+    matches, i.e. neither endpoint moved and the router is the same.
+    """
+    a = (round(a[0], 6), round(a[1], 6))
+    b = (round(b[0], 6), round(b[1], 6))
+    src = f"{a[0]},{a[1]}|{b[0]},{b[1]}|{OSRM_BASE}"
+    return hashlib.sha1(src.encode()).hexdigest()
+
+
+def cache_get(cache, a, b):
+    key, flipped = leg_key(a, b)
+    leg = cache.get(key)
+    if leg is not None and flipped:
+        leg = dict(leg, coords=leg["coords"][::-1])
+    return leg
+
+
+def cache_put(cache, a, b, leg):
+    key, flipped = leg_key(a, b)
+    if flipped:
+        leg = dict(leg, coords=leg["coords"][::-1])
+    cache[key] = leg
+
+
+def edge_chains(edges, indices):
+    """Group edge indices into chains where each edge starts at the previous one's end.
+
+    Each chain becomes a single multi-waypoint /route request, so a connected
+    hub graph costs a handful of requests instead of one per edge. Chains are
+    capped at MAX_LEGS legs to stay under the router's waypoint limit.
+    """
+    outgoing = {}
+    incoming = {}
+    for i in indices:
+        e = edges[i]
+        outgoing.setdefault(e["from"], []).append(i)
+        incoming[e["to"]] = incoming.get(e["to"], 0) + 1
+
+    # Start from hubs with spare outgoing edges first so chains run long.
+    starts = [h for h in outgoing if len(outgoing[h]) > incoming.get(h, 0)]
+    chains = []
+    for hub in starts + list(outgoing):
+        while outgoing[hub]:
+            chain = []
+            cur = hub
+            while outgoing.get(cur) and len(chain) < MAX_LEGS:
+                i = outgoing[cur].pop(0)
+                chain.append(i)
+                cur = edges[i]["to"]
+            chains.append(chain)
+    return chains
+
+
+def real_record(frm, to, key, leg):
     return {
-        "coords": r["geometry"]["coordinates"],  # [[lng,lat],...]
-        "distance_m": int(round(r["distance"])),
-        "duration_s": int(round(r["duration"])),
+        "from": frm,
+        "to": to,
+        "key": key,
+        "distance_m": leg["distance_m"],
+        "duration_s": leg["duration_s"],
+        "polyline": leg["coords"],
     }
 
 
-def main():
+def load_previous(p: Path, name):
+    """Records from an earlier run's output, by (from, to); {} if unusable."""
+    try:
+        records = load_json(p)[name]
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    return {(r["from"], r["to"]): r for r in records if "key" in r}
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Precompute real-road polylines via OSRM.")
+    ap.add_argument(
+        "--osrm-base",
+        default=OSRM_BASE,
+        help=f"OSRM server to query (default: {OSRM_BASE})",
+    )
+    ap.add_argument(
+        "--delay",
+        type=float,
+        help=f"min seconds between requests, across all workers (default: {DELAY}, "
+        "the public OSRM demo's 1 request/second limit; 0 for a local router)",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        help=f"requests in flight (default: {WORKERS}, or {LOCAL_WORKERS} for a local router)",
+    )
+    ap.add_argument(
+        "--straight-link-m",
+        type=int,
+        default=0,
+        metavar="M",
+        help="draw location->hub links shorter than M metres by road as straight "
+        "lines; their lengths come from one /table request per hub (default: 0, off)",
+    )
+    args = ap.parse_args(argv)
+    local = urlsplit(args.osrm_base).hostname in LOCAL_HOSTS
+    if args.delay is None:
+        args.delay = 0 if local else DELAY
+    if args.workers is None:
+        args.workers = LOCAL_WORKERS if local else WORKERS
+    return args
+
+
+def main(argv=None):
+    global OSRM_BASE, WORKERS, LIMITER
+    args = parse_args(argv)
+    OSRM_BASE = args.osrm_base.rstrip("/")
+    WORKERS = args.workers
+    LIMITER = RateLimiter(args.delay)
+    print(f"Using {OSRM_BASE} ({WORKERS} workers, {args.delay}s between requests)")
+
     hubs = load_json(DATA / "hubs.json")["hubs"]
     edges = load_json(DATA / "edges.json")["edges"]
     locs = load_json(DATA / "locations.json")["locations"]
-    hubs_by_id = {h["id"]: h for h in hubs}
-
-    real_edges = []
-    print(f"Routing {len(edges)} hub edges...")
-    for i, e in enumerate(edges, 1):
-        a = hubs_by_id[e["from"]]
-        b = hubs_by_id[e["to"]]
-        print(f"  [{i}/{len(edges)}] {e['from']} -> {e['to']}")
-        try:
-            r = route_osrm(a["lng"], a["lat"], b["lng"], b["lat"])
-            real_edges.append(
-                {
-                    "from": e["from"],
-                    "to": e["to"],
-                    "distance_m": r["distance_m"],
-                    "duration_s": r["duration_s"],
-                    "polyline": r["coords"],
-                }
-            )
-        except Exception as ex:
-            print("    ERROR, keeping fallback edge:", ex)
-            real_edges.append(e)
-        time.sleep(DELAY)
-
-    real_links = []
-    print(f"Routing {len(locs)} location->hub links...")
-    for i, loc in enumerate(locs, 1):
-        hub = hubs_by_id[loc["hubId"]]
-        print(f"  [{i}/{len(locs)}] {loc['id']} -> {loc['hubId']}")
-        try:
-            r = route_osrm(loc["lng"], loc["lat"], hub["lng"], hub["lat"])
-            real_links.append(
-                {
-                    "from": loc["id"],
-                    "to": loc["hubId"],
-                    "distance_m": r["distance_m"],
-                    "duration_s": r["duration_s"],
-                    "polyline": r["coords"],
-                }
-            )
-        except Exception as ex:
-            print("    ERROR, using straight line:", ex)
-            real_links.append(
-                {
-                    "from": loc["id"],
-                    "to": loc["hubId"],
-                    "distance_m": 0,
-                    "duration_s": 0,
-                    "polyline": [[loc["lng"], loc["lat"]], [hub["lng"], hub["lat"]]],
-                }
-            )
-        time.sleep(DELAY)
-
-    save_json(DATA / "edges.real.json", {"edges": real_edges})
-    save_json(DATA / "location_links.real.json", {"links": real_links})
+    # id -> (lng, lat), built once so the loops below do one lookup per point.
+    hub_ll = {h["id"]: (h["lng"], h["lat"]) for h in hubs}
+    loc_ll = [(loc["lng"], loc["lat"]) for loc in locs]
+
+    prev_edges = load_previous(DATA / "edges.real.json", "edges")
+    prev_links = load_previous(DATA / "location_links.real.json", "links")
+
+    with (
+        shelve.open(str(CACHE_PATH)) as cache,
+        RecordWriter(DATA / "edges.real.json", "edges") as real_edges,
+        RecordWriter(DATA / "location_links.real.json", "links") as real_links,
+    ):
+        def endpoints(kind, i):
+            if kind == "edge":
+                return hub_ll[edges[i]["from"]], hub_ll[edges[i]["to"]]
+            return loc_ll[i], hub_ll[locs[i]["hubId"]]
+
+        def finish(kind, i, leg):
+            """Write the record for edge/link i from `leg`, or its fallback if None."""
+            if kind == "edge":
+                e = edges[i]
+                if leg is None:
+                    real_edges.add(i, e)
+                else:
+                    key = route_key(*endpoints(kind, i))
+                    real_edges.add(i, real_record(e["from"], e["to"], key, leg))
+                return
+            loc = locs[i]
+            if leg is None:
+                real_links.add(i, straight_link(i))
+            else:
+                key = route_key(*endpoints(kind, i))
+                real_links.add(i, real_record(loc["id"], loc["hubId"], key, leg))
+
+        def straight_link(i, distance_m=0, duration_s=0):
+            loc = locs[i]
+            return {
+                "from": loc["id"],
+                "to": loc["hubId"],
+                "distance_m": distance_m,
+                "duration_s": duration_s,
+                "polyline": [*endpoints("link", i)],
+            }
+
+        # One request per distinct leg. Repeats and reversed copies (A->B next
+        # to B->A, among edges or links) wait on the first one and are filled
+        # from the cache, which hands the polyline back in their direction.
+        shared = {}  # leg_key -> [(kind, i), ...] waiting on that leg
+
+        def claim(kind, i):
+            """True if (kind, i) should be requested; False if it rides along."""
+            k = leg_key(*endpoints(kind, i))[0]
+            if k in shared:
+                shared[k].append((kind, i))
+                return False
+            shared[k] = []
+            return True
+
+        def fan_out(kind, i, leg):
+            """Finish (kind, i) and every record sharing its leg."""
+            a, b = endpoints(kind, i)
+            if leg is not None:
+                cache_put(cache, a, b, leg)
+            finish(kind, i, leg)
+            for other in shared.pop(leg_key(a, b)[0], ()):
+                finish(*other, None if leg is None else cache_get(cache, *endpoints(*other)))
+
+        todo = []
+        edges_reused = 0
+        for i, e in enumerate(edges):
+            a, b = endpoints("edge", i)
+            prev = prev_edges.get((e["from"], e["to"]))
+            if prev is not None and prev["key"] == route_key(a, b):
+                real_edges.add(i, prev)
+                edges_reused += 1
+                continue
+            leg = cache_get(cache, a, b)
+            if leg is not None:
+                finish("edge", i, leg)
+                edges_reused += 1
+            elif claim("edge", i):
+                todo.append(i)
+
+        tasks = []
+        for chain in edge_chains(edges, todo):
+            points = [hub_ll[edges[chain[0]]["from"]]]
+            for i in chain:
+                points.append(hub_ll[edges[i]["to"]])
+            tasks.append((("edge", chain), points))
+
+        links_reused = 0
+        link_todo = []
+        for i, loc in enumerate(locs):
+            a, b = endpoints("link", i)
+            prev = prev_links.get((loc["id"], loc["hubId"]))
+            if prev is not None and prev["key"] == route_key(a, b):
+                real_links.add(i, prev)
+                links_reused += 1
+                continue
+            leg = cache_get(cache, a, b)
+            if leg is not None:
+                finish("link", i, leg)
+                links_reused += 1
+            else:
+                link_todo.append(i)
+
+        links_straight = 0
+        if args.straight_link_m > 0 and link_todo:
+            # Size up the remaining links with one /table per hub (all of its
+            # locations as sources), and only pay for a /route on the long ones.
+            by_hub = {}
+            for i in link_todo:
+                by_hub.setdefault(locs[i]["hubId"], []).append(i)
+            table_tasks = []
+            for hub_id, idxs in by_hub.items():
+                for n in range(0, len(idxs), MAX_TABLE):
+                    chunk = idxs[n : n + MAX_TABLE]
+                    table_tasks.append((chunk, [hub_ll[hub_id]] + [loc_ll[i] for i in chunk]))
+
+            print(f"Measuring {len(link_todo)} location->hub links in {len(table_tasks)} requests...")
+            link_todo = []
+            for chunk, sizes in run_tasks("tables", table_tasks, fn=table_osrm):
+                if isinstance(sizes, Exception):
+                    warn("    ERROR measuring links, routing them instead:", sizes)
+                    link_todo.extend(chunk)
+                    continue
+                for i, size in zip(chunk, sizes):
+                    if size is None or size[0] >= args.straight_link_m:
+                        link_todo.append(i)
+                        continue
+                    # No "key": re-measured every run, so changing the
+                    # threshold takes effect without clearing anything.
+                    real_links.add(i, straight_link(i, *size))
+                    links_straight += 1
+            link_todo.sort()
+
+        for i in link_todo:
+            if claim("link", i):
+                tasks.append((("link", i), [*endpoints("link", i)]))
+
+        # Edges and links share one pool so the rate limit, not a phase
+        # boundary, is what paces the run.
+        print(
+            f"Routing {len(edges)} hub edges ({edges_reused} reused) and "
+            f"{len(locs)} location->hub links ({links_reused} reused, "
+            f"{links_straight} straight) in {len(tasks)} requests..."
+        )
+        while tasks:
+            retry = []
+            for (kind, ref), legs in run_tasks("routes", tasks):
+                if kind == "edge":
+                    if isinstance(legs, Exception) and len(ref) > 1:
+                        # One unroutable leg fails the whole multi-waypoint
+                        # request, so route the chain's edges one by one.
+                        hops = " -> ".join([edges[ref[0]]["from"]] + [edges[i]["to"] for i in ref])
+                        warn(f"    {hops} failed as a chain, routing its edges one by one:", legs)
+                        for i in ref:
+                            retry.append((("edge", [i]), [*endpoints("edge", i)]))
+                        continue
+                    if isinstance(legs, Exception):
+                        e = edges[ref[0]]
+                        warn(f"    ERROR {e['from']} -> {e['to']}, keeping fallback edge:", legs)
+                    for n, i in enumerate(ref):
+                        fan_out("edge", i, None if isinstance(legs, Exception) else legs[n])
+                    continue
+
+                if isinstance(legs, Exception):
+                    loc = locs[ref]
+                    warn(f"    ERROR {loc['id']} -> {loc['hubId']}, using straight line:", legs)
+                fan_out("link", ref, None if isinstance(legs, Exception) else legs[0])
+            tasks = retry
+
     print("\nDone.")
     print("Wrote docs/data/edges.real.json") 
     print("Wrote docs/data/location_links.real.json")